@@ -1,74 +1,407 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import html
 import json
+import orjson
+import string
+import tempfile
+import socket
 import concurrent.futures
-from functools import lru_cache
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+from contextlib import contextmanager
+from cachetools import TTLCache
+from diskcache import Cache
+from selectolax.lexbor import LexborHTMLParser
 import google.generativeai as genai
+from google.generativeai import client as genai_client
 import os
 
 app = Flask(__name__)
 
-@lru_cache(maxsize=100)
-def shorten_with_gemini(text, api_key):
+# Upper bound on concurrent title fetches per /extract request
+_MAX_WORKERS = 32
+
+# At most this many simultaneous fetches go to any one host, to avoid getting blocked
+_PER_HOST_LIMIT = 4
+
+# Generic link shorteners are only resolved when the client asks for it.
+# Affiliate short links (e.g. amzn.to) are not listed: they are the main input.
+_SHORTENER_HOSTS = frozenset({
+    'bit.ly', 'tinyurl.com', 'goo.gl', 't.co', 'ow.ly', 'is.gd',
+    'buff.ly', 'rebrand.ly', 'cutt.ly', 'shorturl.at',
+})
+
+def _make_session(retries):
+    session = requests.Session()
+    # pool_connections is the number of per-host pools kept (LRU-evicted), so
+    # it has to cover every distinct host one request can fetch from;
+    # pool_maxsize is per host, where _host_slot already caps concurrency.
+    adapter = HTTPAdapter(pool_connections=_MAX_WORKERS * 2, pool_maxsize=_PER_HOST_LIMIT,
+                          max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept-Language': 'en-US,en;q=0.9',
+    })
+    return session
+
+# Shared HTTP session: keep-alive + urllib3 pooling reuses sockets across
+# the enrichment threads instead of a new TCP/TLS handshake per link.
+SESSION = _make_session(Retry(total=2, backoff_factor=0.2))
+# Same, without retries, for fetches made while a client waits on /extract:
+# retrying read/connect timeouts would multiply the timeout on slow hosts.
+_NO_RETRY_SESSION = _make_session(0)
+
+# Description links span many domains and every new pooled connection
+# resolves its host again; cache getaddrinfo results for a few minutes.
+_dns_cache = TTLCache(maxsize=1024, ttl=300)
+_dns_lock = threading.Lock()
+_original_getaddrinfo = socket.getaddrinfo
+
+def _cached_getaddrinfo(*args, **kwargs):
+    key = (args, tuple(sorted(kwargs.items())))
+    with _dns_lock:
+        result = _dns_cache.get(key)
+    if result is None:
+        result = _original_getaddrinfo(*args, **kwargs)
+        with _dns_lock:
+            _dns_cache[key] = result
+    return result
+
+socket.getaddrinfo = _cached_getaddrinfo
+
+# Compiled once at import time instead of on every request / line
+# Captures the text between leading/trailing separators, arrows and whitespace
+_TRIM_RE = re.compile(r'[:\-\|\s\u2190-\u2199]*(.*?)[:\-\|\s\u2190-\u2199]*', re.DOTALL)
+_ALNUM_RE = re.compile(r'[a-zA-Z0-9]')
+_TITLE_RE = re.compile(r'<title>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+_META_DESC_RE = re.compile(r'<meta name="description" content="(.*?)">')
+# JSON string body; skips escaped quotes so the description isn't cut short
+_SHORTDESC_RE = re.compile(r'"shortDescription":"((?:[^"\\]|\\.)*)"')
+_TRACKING_PARAM_RE = re.compile(r'^utm_|^fbclid$|^gclid$')
+
+# Gemini results on disk, shared safely between gunicorn workers. Point
+# GEMINI_CACHE_DIR at persistent storage to keep them across restarts; the
+# default temp dir is gone whenever the dyno/container is replaced.
+_gemini_cache = Cache(os.environ.get('GEMINI_CACHE_DIR')
+                      or os.path.join(tempfile.gettempdir(), 'youtube-link-extractor-gemini'),
+                      size_limit=100 * 2**20)
+_GEMINI_CACHE_EXPIRE = 30 * 86400
+_GEMINI_BATCH_SIZE = 10
+_GEMINI_MAX_INFLIGHT = 8
+
+def _gemini_cache_key(title):
+    # Titles differing only in case or whitespace share an entry
+    return ' '.join(title.lower().split())
+
+# One GenerativeModel per API key, built on first use
+_models = {}
+_models_lock = threading.Lock()
+
+def _get_model(api_key):
+    model = _models.get(api_key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(api_key)
+            if model is None:
+                genai.configure(api_key=api_key)
+                model = genai.GenerativeModel('gemini-pro')
+                # GenerativeModel only creates its client on the first call, from
+                # whatever genai.configure set last. Bind it now, under the lock,
+                # or another request's configure() could attach its key to this model.
+                model._client = genai_client.get_default_generative_client()
+                _models[api_key] = model
+    return model
+
+def _shorten_batch(model, titles):
+    prompt = (
+        "Shorten each of these product titles to maximum 25 characters. "
+        "Each must make sense and be catchy. "
+        "Return ONLY a JSON array of strings in the same order: "
+        + json.dumps(titles, ensure_ascii=False)
+    )
+    response = model.generate_content(prompt)
+    text = response.text.strip()
+    # The model sometimes wraps the JSON in a ```json fence
+    if text.startswith('```'):
+        text = text.strip('`').removeprefix('json').strip()
+    shortened = json.loads(text)
+    if not isinstance(shortened, list) or len(shortened) != len(titles):
+        raise ValueError(f"expected {len(titles)} titles, got {shortened!r}")
+    return shortened
+
+def shorten_titles_with_gemini(titles, api_key):
+    """Shorten a list of titles with as few Gemini calls as possible.
+
+    Returns a list of the same length holding the short title, or None where
+    Gemini was unavailable or returned nothing usable.
+    """
     if not api_key:
-        return None
+        return [None] * len(titles)
+
+    keys = [_gemini_cache_key(t) for t in titles]
+    pending = {}
+    for title, key in zip(titles, keys):
+        if key not in pending and key not in _gemini_cache:
+            pending[key] = title
+
+    # Large sets go out as several smaller prompts in flight at once over the
+    # same model (and gRPC channel) rather than one long generation
+    pending_keys = list(pending)
+    batches = [pending_keys[i:i + _GEMINI_BATCH_SIZE]
+               for i in range(0, len(pending_keys), _GEMINI_BATCH_SIZE)]
+    if batches:
+        # Resolve (and, for a new key, bind) the model here rather than on the
+        # pool threads, so the batches only ever share an already-bound client
+        try:
+            model = _get_model(api_key)
+        except Exception as e:
+            print(f"Gemini API Error: {e}")
+            batches = []
+    if batches:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(_GEMINI_MAX_INFLIGHT, len(batches))) as executor:
+            future_to_batch = {
+                executor.submit(_shorten_batch, model, [pending[k] for k in batch]): batch
+                for batch in batches
+            }
+            for future in concurrent.futures.as_completed(future_to_batch):
+                try:
+                    shortened = future.result()
+                except Exception as e:
+                    print(f"Gemini API Error: {e}")
+                    continue
+                for key, short in zip(future_to_batch[future], shortened):
+                    if isinstance(short, str) and short.strip():
+                        _gemini_cache.set(key, short.strip(), expire=_GEMINI_CACHE_EXPIRE)
+
+    return [_gemini_cache.get(key) for key in keys]
+
+def canonicalize_url(url):
+    """Drop tracking params and the fragment and lowercase scheme/host, so
+    links differing only by UTM tags share a fetch and a cache entry.
+
+    Only used as a grouping/cache key; the original URL is what gets fetched.
+    """
+    parts = urlsplit(url)
+    # Filter the raw query pairs rather than round-tripping through
+    # parse_qsl/urlencode, which would rewrite '?ref' and '%20'
+    query = '&'.join(
+        pair for pair in parts.query.split('&')
+        if pair and not _TRACKING_PARAM_RE.match(pair.split('=', 1)[0])
+    )
+    userinfo, at, hostport = parts.netloc.rpartition('@')
+    return urlunsplit((parts.scheme.lower(), userinfo + at + hostport.lower(), parts.path or '/', query, ''))
+
+def _is_shortener(url):
+    host = urlsplit(url).hostname or ''
+    return host.removeprefix('www.') in _SHORTENER_HOSTS
+
+# host -> [semaphore, number of threads using or waiting on it]; entries are
+# removed once idle so the dict doesn't grow with every host ever seen
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+@contextmanager
+def _host_slot(url):
+    host = urlsplit(url).hostname or ''
+    with _host_semaphores_lock:
+        entry = _host_semaphores.get(host)
+        if entry is None:
+            entry = _host_semaphores[host] = [threading.Semaphore(_PER_HOST_LIMIT), 0]
+        entry[1] += 1
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-pro')
-        prompt = f"Shorten the following product title to maximum 25 characters. It must make sense and be catchy. Original: '{text}'. Return ONLY the shortened title."
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        print(f"Gemini API Error: {e}")
+        with entry[0]:
+            yield
+    finally:
+        with _host_semaphores_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _host_semaphores[host]
+
+# Give up looking for </title> after this many bytes of a page
+_TITLE_SCAN_LIMIT = 65536
+
+# Drain at most this many unread body bytes to keep a connection reusable
+_DRAIN_LIMIT = 32768
+
+def _unread_bytes(res):
+    # Content-Length counts bytes on the wire, which raw.tell() also counts
+    try:
+        return int(res.headers['Content-Length']) - res.raw.tell()
+    except (KeyError, ValueError):
         return None
 
-@lru_cache(maxsize=100)
-def get_page_title(url):
+# Page title cache: url -> (title, fetched_at). Entries older than half the
+# TTL are still served but refreshed in the background (stale-while-revalidate).
+_TITLE_TTL = 3600
+_title_cache = TTLCache(maxsize=2048, ttl=_TITLE_TTL)
+_title_lock = threading.RLock()
+_title_refreshing = set()
+_refresh_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+def _fetch_page_title(url, timeout=5, session=SESSION):
+    # Bounds the body download too; requests' timeout only applies per socket read
+    deadline = time.monotonic() + timeout
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-             'Accept-Language': 'en-US,en;q=0.9',
-        }
-        res = requests.get(url, headers=headers, timeout=5)
-        
-        # Try to use encoding from headers, default to utf-8
-        if res.encoding is None or res.encoding.lower() == 'iso-8859-1':
-            res.encoding = 'utf-8' # Default to utf-8 for modern web
-        
-        if res.status_code == 200:
-            title_match = re.search(r'<title>(.*?)</title>', res.text, re.IGNORECASE | re.DOTALL)
-            if title_match:
-                title = title_match.group(1).strip()
-                # Clean up common suffixes if needed, or keep as is.
-                # User example: "Jelení jerky - GymBeam" -> looks like full title is wanted.
-                return title
+        # Stream the body and stop once </title> has arrived; the rest of the page is never needed
+        with _host_slot(url), session.get(url, stream=True, timeout=timeout) as res:
+            if res.status_code != 200:
+                return ""
+            buf = bytearray()
+            for chunk in res.iter_content(8192):
+                # Only rescan the new chunk plus enough overlap for a split tag
+                scan_from = max(0, len(buf) - 7)
+                buf += chunk
+                if b'</title>' in buf[scan_from:].lower() or len(buf) > _TITLE_SCAN_LIMIT \
+                        or time.monotonic() > deadline:
+                    # Closing a partly read response makes urllib3 drop the socket
+                    # instead of pooling it. When only a little is left, reading
+                    # it is cheaper than a new handshake next time; for large or
+                    # chunked bodies the connection is dropped.
+                    remaining = _unread_bytes(res)
+                    if remaining is not None and remaining <= _DRAIN_LIMIT:
+                        for _ in res.iter_content(8192):
+                            if time.monotonic() > deadline:
+                                break
+                    break
+
+            # Try to use encoding from headers, default to utf-8
+            encoding = res.encoding
+            if encoding is None or encoding.lower() == 'iso-8859-1':
+                encoding = 'utf-8' # Default to utf-8 for modern web
+
+        page = buf.decode(encoding, errors='replace')
+        # Lexbor handles <title lang=...> and stray markup; regex is the fallback
+        node = LexborHTMLParser(page).css_first('title')
+        title = node.text(strip=True) if node is not None else ''
+        if title:
+            return title
+
+        title_match = _TITLE_RE.search(page)
+        if title_match:
+            title = title_match.group(1).strip()
+            # Clean up common suffixes if needed, or keep as is.
+            # User example: "Jelení jerky - GymBeam" -> looks like full title is wanted.
+            return title
     except Exception as e:
         print(f"Error fetching title for {url}: {e}")
     return ""
 
+def _refresh_page_title(key, url):
+    try:
+        title = _fetch_page_title(url)
+        # Keep serving the stale title if the refresh failed
+        if title:
+            with _title_lock:
+                _title_cache[key] = (title, time.monotonic())
+    finally:
+        with _title_lock:
+            _title_refreshing.discard(key)
+
+def get_page_title(url):
+    # Cached under the canonical URL so UTM variants share an entry
+    key = canonicalize_url(url)
+    with _title_lock:
+        entry = _title_cache.get(key)
+        if entry is not None:
+            title, fetched_at = entry
+            if time.monotonic() - fetched_at > _TITLE_TTL / 2 and key not in _title_refreshing:
+                _title_refreshing.add(key)
+                _refresh_executor.submit(_refresh_page_title, key, url)
+            return title
+
+    # Cold miss: fetch synchronously with a short timeout and no retries, so a
+    # slow site costs roughly the connect + read timeouts, not several attempts
+    title = _fetch_page_title(url, timeout=3, session=_NO_RETRY_SESSION)
+    with _title_lock:
+        _title_cache[key] = (title, time.monotonic())
+    return title
+
+# Lookup table of characters allowed inside a URL, indexed by code point.
+# Used by _find_urls for a single linear scan instead of a backtracking regex.
+_URL_CHARS = bytes(
+    1 if chr(c) in string.ascii_letters + string.digits + "-@:%._+~#=()?&/" else 0
+    for c in range(256)
+)
+
+def _host_has_dot(line, start, end):
+    # Same as '.' in host.strip('.'), without slicing the host out of the line
+    while start < end and line[start] == '.':
+        start += 1
+    while end > start and line[end - 1] == '.':
+        end -= 1
+    return line.find('.', start, end) != -1
+
+def _find_urls(line):
+    """Return (start, end) spans of the URLs in a line."""
+    spans = []
+    n = len(line)
+    run_end = -1
+    pos = line.find('http')
+    while pos != -1:
+        if line.startswith('https://', pos):
+            host_start = pos + 8
+        elif line.startswith('http://', pos):
+            host_start = pos + 7
+        else:
+            pos = line.find('http', pos + 4)
+            continue
+
+        # A candidate inside the run of URL characters already walked ends
+        # where that run ends, so each character is only walked once
+        if pos >= run_end:
+            run_end = pos
+            while run_end < n:
+                cp = ord(line[run_end])
+                if cp > 255 or not _URL_CHARS[cp]:
+                    break
+                run_end += 1
+        end = run_end
+
+        host_end = line.find('/', host_start, end)
+        if host_end == -1:
+            host_end = end
+        if _host_has_dot(line, host_start, host_end):
+            spans.append((pos, end))
+            pos = line.find('http', end)
+        else:
+            pos = line.find('http', pos + 4)
+    return spans
+
+_MAX_DESCRIPTION_CHARS = 20000
+
 def extract_links_with_text(description):
     if not description:
         return []
-    lines = description.split('\n')
+    # Guard against pathological input; YouTube itself caps descriptions at 5000 chars
+    lines = description[:_MAX_DESCRIPTION_CHARS].split('\n')
     extracted = []
-    
-    # Regex for finding URLs
-    url_pattern = re.compile(r'https?://(?:www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_\+.~#?&//=]*)')
+    prev_has_url = False
     
     for i, line in enumerate(lines):
-        matches = list(url_pattern.finditer(line))
+        # Most lines are plain prose; skip them with a C-level substring check
+        if 'http' not in line:
+            prev_has_url = False
+            continue
+
+        spans = _find_urls(line)
         
-        for match in matches:
-            url = match.group(0)
+        for start, end in spans:
+            url = line[start:end]
             
             # Strategy 1: Look for text on the same line
-            text_on_line = line.replace(url, '').strip()
+            text_on_line = line[:start] + line[end:]
             # Clean up common separators and arrows
-            text_on_line_cleaned = re.sub(r'^[:\-\|\s\u2190-\u2199]+|[:\-\|\s\u2190-\u2199]+$', '', text_on_line).strip()
+            text_on_line_cleaned = _TRIM_RE.fullmatch(text_on_line).group(1)
             
             # Check if text is meaningful (has alphanumeric chars)
-            has_alnum = bool(re.search(r'[a-zA-Z0-9]', text_on_line_cleaned))
+            has_alnum = bool(_ALNUM_RE.search(text_on_line_cleaned))
             
             if text_on_line_cleaned and has_alnum:
                 extracted.append({'text': text_on_line_cleaned, 'url': url})
@@ -78,117 +411,167 @@ def extract_links_with_text(description):
                 if i > 0:
                     prev_line = lines[i-1].strip()
                     # Check if previous line is not a URL itself
-                    if not url_pattern.search(prev_line) and prev_line:
+                    if not prev_has_url and prev_line:
                          extracted.append({'text': prev_line, 'url': url})
                          found_prev = True
                 
                 if not found_prev:
                      extracted.append({'text': 'Link', 'url': url})
+        
+        prev_has_url = bool(spans)
                     
     return extracted
 
+def _fetch_video_info_with_ytdlp(video_url):
+    # Slow path: yt-dlp does several signed requests and runs the player JS
+    import yt_dlp
+
+    # Workaround for "Sign in to confirm you’re not a bot": Use authenticated-like client (iOS)
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['ios'],
+                'player_skip': ['webpage', 'configs', 'js'], 
+            }
+        },
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1',
+        }
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(video_url, download=False)
+        return info.get('title', 'Unknown Video'), info.get('description', '')
+
+def fetch_video_info(video_url):
+    """Return (title, description) for a video, scraping the watch page HTML
+    and only falling back to yt-dlp when nothing usable is found."""
+    try:
+        # The client is waiting, and yt-dlp is the fallback: don't retry timeouts
+        res = _NO_RETRY_SESSION.get(video_url, timeout=8)
+        res.raise_for_status()
+        page = res.text
+
+        video_title = 'Unknown Video'
+        title_match = _TITLE_RE.search(page)
+        if title_match:
+            video_title = html.unescape(title_match.group(1)).strip()
+            if video_title.endswith(' - YouTube'):
+                video_title = video_title[:-len(' - YouTube')]
+
+        desc_match = _SHORTDESC_RE.search(page)
+        if desc_match:
+            try:
+                return video_title, json.loads(f'"{desc_match.group(1)}"')
+            except ValueError as e:
+                print(f"Error decoding description for {video_url}: {e}")
+
+        # Meta description is truncated, but still better than another round trip
+        meta_match = _META_DESC_RE.search(page)
+        if meta_match:
+            return video_title, html.unescape(meta_match.group(1))
+    except Exception as e:
+        print(f"Error scraping {video_url}: {e}")
+
+    return _fetch_video_info_with_ytdlp(video_url)
+
+def derive_short_title(full_title):
+    """Heuristic short title; may still exceed 25 chars if nothing fits."""
+    # 1. First, clean the title of common site suffixes (e.g., " | SiteName").
+    # find/rfind + slicing avoid the temporary lists split/rsplit would build.
+    cut = full_title.find(' | ')
+    cleaned_title = (full_title if cut == -1 else full_title[:cut]).strip()
+
+    # 2. Determine Short Title
+    if len(cleaned_title) <= 25:
+        return cleaned_title
+
+    # Too long. Try checking for " - Brand" pattern or similar
+    # Example: "Pink Burn Drink - GymBeam" -> "Pink Burn Drink"
+    cut = cleaned_title.rfind(' - ')
+    if cut != -1:
+        first_part = cleaned_title[:cut].strip()
+        if len(first_part) <= 25:
+            return first_part
+
+    # Still too long; caller decides between Gemini and truncation
+    return cleaned_title
+
+def _json(obj, status=200):
+    # orjson encodes the (often multi-KB) description and link list much faster than jsonify
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/extract', methods=['POST'])
 def extract():
-    data = request.json
+    try:
+        data = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        return _json({'error': 'Invalid JSON body'}, 400)
     video_url = data.get('url')
     api_key = data.get('api_key') or os.environ.get('GEMINI_API_KEY')
+    resolve_short_links = bool(data.get('resolve_short_links'))
     
     if not video_url:
-        return jsonify({'error': 'No URL provided'}), 400
+        return _json({'error': 'No URL provided'}, 400)
 
     try:
-        # Use yt-dlp to extract metadata - much more robust against blocking
-        import yt_dlp
-
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-            'extract_flat': True, # Faster, but might miss full description sometimes. 
-            # If extract_flat doesn't give full description, we might need to remove it. 
-            # But let's try to be fast first.
-        }
-        
-        # We need full description, so extract_flat might be too "flat".
-        # Let's try without extract_flat but with skip_download
-        # Workaround for "Sign in to confirm you’re not a bot": Use authenticated-like client (iOS)
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['ios'],
-                    'player_skip': ['webpage', 'configs', 'js'], 
-                }
-            },
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1',
-            }
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # yt-dlp can handle the extraction
-            info = ydl.extract_info(video_url, download=False)
-            video_title = info.get('title', 'Unknown Video')
-            description = info.get('description', '')
+        video_title, description = fetch_video_info(video_url)
         
         links = extract_links_with_text(description)
         
-        # Enrich links with page titles concurrently
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_link = {executor.submit(get_page_title, link['url']): link for link in links}
-            for future in concurrent.futures.as_completed(future_to_link):
-                link = future_to_link[future]
+        # The same URL often appears several times (e.g. one affiliate link per section,
+        # or with different UTM tags); fetch each distinct URL once and fan the title
+        # out to every link using it
+        by_url = {}
+        for link in links:
+            by_url.setdefault(canonicalize_url(link['url']), []).append(link)
+        to_fetch = [url for url in by_url if resolve_short_links or not _is_shortener(url)]
+
+        # Enrich links with page titles concurrently, one worker per URL up to the cap
+        page_titles = {}
+        workers = max(1, min(_MAX_WORKERS, len(to_fetch)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # Fetch the link as written; the canonical form is only the grouping key
+            future_to_url = {executor.submit(get_page_title, by_url[url][0]['url']): url for url in to_fetch}
+            for future in concurrent.futures.as_completed(future_to_url):
+                url = future_to_url[future]
                 try:
-                    page_title = future.result()
-                    # Logic: Use title if found, else text.
-                    full_title = page_title if page_title else link['text']
-                    link['page_title'] = full_title
-                    
-                    # 1. First, clean the title of common site suffixes (e.g., " | SiteName")
-                    cleaned_title = full_title.split(' | ')[0].strip() # Always prefer left part if pipe exists
-                    
-                    # 2. Determine Short Title
-                    potential_short_title = cleaned_title
-                    
-                    if len(potential_short_title) <= 25:
-                        # Perfect fit
-                        short_title = potential_short_title
-                    else:
-                        # Too long. Try checking for " - Brand" pattern or similar
-                        # Example: "Pink Burn Drink - GymBeam" -> "Pink Burn Drink"
-                        if ' - ' in potential_short_title:
-                            parts = potential_short_title.rsplit(' - ', 1)
-                            # Only take the first part if it reduces length enough or is just better
-                            first_part = parts[0].strip()
-                            if len(first_part) <= 25:
-                                short_title = first_part
-                            else:
-                                # First part still too long. Use Gemini or truncate.
-                                short_title = potential_short_title 
-                        else:
-                             short_title = potential_short_title
-
-                        if len(short_title) > 25:
-                            gemini_title = shorten_with_gemini(short_title, api_key)
-                            if gemini_title:
-                                short_title = gemini_title
-                            else:
-                                short_title = short_title[:25].rstrip(' :,.|-')
-                        
-                    link['short_title'] = short_title
-                    
+                    page_titles[url] = future.result()
                 except Exception as exc:
-                    print(f'{link["url"]} generated an exception: {exc}')
-                    link['page_title'] = link['text']
-                    link['short_title'] = link['text'][:25]
+                    print(f'{url} generated an exception: {exc}')
+
+        needs_llm = []
+        for url, url_links in by_url.items():
+            page_title = page_titles.get(url)
+            for link in url_links:
+                # Logic: Use title if found, else text.
+                full_title = page_title if page_title else link['text']
+                link['page_title'] = full_title
+                
+                short_title = derive_short_title(full_title)
+                link['short_title'] = short_title
+                if len(short_title) > 25:
+                    # Still too long: shorten with Gemini in one batch after all titles are in
+                    needs_llm.append(link)
+
+        if needs_llm:
+            gemini_titles = shorten_titles_with_gemini([link['short_title'] for link in needs_llm], api_key)
+            for link, gemini_title in zip(needs_llm, gemini_titles):
+                if gemini_title:
+                    link['short_title'] = gemini_title
+                else:
+                    link['short_title'] = link['short_title'][:25].rstrip(' :,.|-')
 
-        return jsonify({
+        return _json({
             'title': video_title,
             'description': description, # for debug if needed
             'links': links
@@ -196,7 +579,9 @@ def extract():
         
     except Exception as e:
         print(f"Error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return _json({'error': str(e)}, 500)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Werkzeug dev server for local debugging only (FLASK_DEV=1 turns on the
+    # debugger and reloader); deployments run under gunicorn, see Procfile
+    app.run(debug=bool(os.environ.get('FLASK_DEV')), port=5000)
@@ -16,4 +16,8 @@ fi
 # Run the app
 echo "Starting YouTube Link Extractor..."
 echo "Open your browser at: http://127.0.0.1:5000"
-python3 app.py
+if [ -n "$FLASK_DEV" ]; then
+    python3 app.py
+else
+    gunicorn -k gthread --workers 4 --threads 8 --timeout 60 --bind 127.0.0.1:5000 app:app
+fi
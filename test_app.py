@@ -0,0 +1,123 @@
+import os
+import re
+import tempfile
+import time
+
+import pytest
+
+# Keep the Gemini disk cache out of the real cache directory
+os.environ['GEMINI_CACHE_DIR'] = tempfile.mkdtemp()
+
+import app
+
+# The URL and separator patterns extract_links_with_text used before the
+# linear scanner and _TRIM_RE replaced them; the new code must agree with them.
+OLD_URL_RE = re.compile(r'https?://(?:www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_\+.~#?&//=]*)')
+OLD_SEP_RE = re.compile(r'^[:\-\|\s←-↙]+|[:\-\|\s←-↙]+$')
+
+
+@pytest.mark.parametrize('line', [
+    'Protein: https://gymbeam.sk/p?id=1&utm_source=yt',
+    'Shop (https://a.com/x_(y)) now',
+    'See https://a.com/x. and https://b.com/y, or https://c.com!',
+    'Čaj → https://shop.sk/čaj-zelený',
+    'https://ä.com/x',
+    'nothttps://a.com/x',
+    'http://localhost/a.b',
+    'https://foo',
+    'https://.com',
+    'https://a.com/r?u=https://b.com/x&v=1',
+    'http://foo/https://b.com',
+    'httpbin https://x.co http://',
+    '',
+])
+def test_find_urls_matches_old_regex(line):
+    expected = [m.span() for m in OLD_URL_RE.finditer(line)]
+    assert app._find_urls(line) == expected
+
+
+@pytest.mark.parametrize('line', ['http' * 5000, 'http://a' * 2500, 'https://' + 'http' * 5000])
+def test_find_urls_is_linear(line):
+    start = time.perf_counter()
+    app._find_urls(line)
+    assert time.perf_counter() - start < 0.5
+
+
+@pytest.mark.parametrize('text', [' Whey: ', '→ Protein | ', '', '  ::  ', 'a - b - ', 'x\ty ←'])
+def test_trim_matches_old_separator_cleanup(text):
+    expected = OLD_SEP_RE.sub('', text.strip()).strip()
+    assert app._TRIM_RE.fullmatch(text).group(1) == expected
+
+
+def test_extract_links_with_text():
+    description = '\n'.join([
+        'Whey protein',
+        'https://a.com/x',
+        'https://b.com',
+        '→ Creatine: https://c.com',
+    ])
+    assert app.extract_links_with_text(description) == [
+        {'text': 'Whey protein', 'url': 'https://a.com/x'},
+        {'text': 'Link', 'url': 'https://b.com'},
+        {'text': 'Creatine', 'url': 'https://c.com'},
+    ]
+
+
+def test_canonicalize_url_only_drops_tracking_and_lowercases_host():
+    url = 'HTTPS://User:PW@GymBeam.SK/Path?ref&q=a%20b&utm_source=yt&fbclid=1#reviews'
+    assert app.canonicalize_url(url) == 'https://User:PW@gymbeam.sk/Path?ref&q=a%20b'
+    assert app.canonicalize_url('https://a.com?utm_medium=x') == app.canonicalize_url('https://a.com/')
+
+
+class _RecordingExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append((fn, args))
+
+
+def test_get_page_title_serves_stale_and_refreshes_once(monkeypatch):
+    executor = _RecordingExecutor()
+    monkeypatch.setattr(app, '_refresh_executor', executor)
+    monkeypatch.setattr(app, '_fetch_page_title', lambda *a, **kw: pytest.fail('stale hit must not fetch'))
+    url = 'https://shop.example/p?utm_source=yt'
+    key = app.canonicalize_url(url)
+    app._title_cache[key] = ('Old title', time.monotonic() - app._TITLE_TTL * 0.75)
+    try:
+        assert app.get_page_title(url) == 'Old title'
+        assert app.get_page_title(url) == 'Old title'
+        assert executor.submitted == [(app._refresh_page_title, (key, url))]
+    finally:
+        app._title_cache.pop(key, None)
+        app._title_refreshing.discard(key)
+
+
+def test_extract_fetches_each_distinct_url_once(monkeypatch):
+    description = '\n'.join([
+        'Whey: https://shop.example/whey?utm_source=yt',
+        'Whey again: https://shop.example/whey',
+        'Creatine: https://shop.example/creatine',
+    ])
+    fetched = []
+
+    def fake_get_page_title(url):
+        fetched.append(url)
+        return 'Title of ' + url.rsplit('/', 1)[1].split('?')[0]
+
+    monkeypatch.setattr(app, 'fetch_video_info', lambda url: ('Video', description))
+    monkeypatch.setattr(app, 'get_page_title', fake_get_page_title)
+    response = app.app.test_client().post('/extract', json={'url': 'https://youtu.be/x'})
+
+    assert response.status_code == 200
+    assert sorted(fetched) == ['https://shop.example/creatine', 'https://shop.example/whey?utm_source=yt']
+    assert [link['page_title'] for link in response.get_json()['links']] == [
+        'Title of whey', 'Title of whey', 'Title of creatine',
+    ]
+
+
+@pytest.mark.parametrize('body', ['not json', '[1, 2]', '"url"'])
+def test_extract_rejects_non_object_body(body):
+    response = app.app.test_client().post('/extract', data=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid JSON body'}